@@ -1,143 +1,897 @@
 #!/bin/python3
 #Keebie by Elisha Shaddock UwU
 
-from evdev import InputDevice, categorize, ecodes
 import sys
 import signal
 import os
 import json
 import argparse
 import time
+import subprocess
+import threading
+import queue
+import collections
+import itertools
+import selectors
+import shlex
+import traceback
+
+evdev = None # evdev and asyncio (which evdev imports anyway) are only imported by importInput(), for the commands that read input, so the rest start quickly
+asyncio = None
+ecodes = None
+
+def importInput(): # Imports the modules we need to read and write input devices
+    global evdev, asyncio, ecodes
+    import evdev
+    import asyncio
+    ecodes = evdev.ecodes
 
 filePath = os.path.abspath(os.path.dirname(sys.argv[0])) + "/" # Get the absolute path to the directory of this script for use when opening files
 
 settings = { # A dict of settings to be used across the script
     "multiKeyMode": "combination",
     "forceBackground": False,
-    "backgroundInversion": False
+    "backgroundInversion": False,
+    "maxWorkers": 4,
+    "busyPolicy": "queue",
+    "sequenceTimeout": 1000,
+    "pythonWorker": False,
+    "holdTime": 300,
+    "doubleTapTime": 250,
+    "repeatRate": 100
 }
 
 settingsPossible = { # A dict of lists of valid values for each setting
     "multiKeyMode": ["combination", "sequence"],
     "forceBackground": [True, False],
-    "backgroundInversion": [True, False]
+    "backgroundInversion": [True, False],
+    "maxWorkers": [1, 2, 4, 8, 16],
+    "busyPolicy": ["queue", "drop", "parallel"],
+    "sequenceTimeout": [250, 500, 750, 1000, 1500, 2000],
+    "pythonWorker": [True, False],
+    "holdTime": [150, 200, 300, 500, 750, 1000],
+    "doubleTapTime": [150, 200, 250, 300, 400, 500],
+    "repeatRate": [33, 50, 100, 200, 500, 1000]
 }
 
 class keyLedger():
     """A class for finding all keys pressed at any time."""
     def __init__(self):
-        self.keysList = [] # A list of keycodes of keys being held as strings
-        self.newKeysList = [] # A list of keycodes of keys that were newly held when update() was last run as strings
-        self.freshKeysList = [] # A list of keycodes of keys being held as strings that is empty unless a new key was pressed when update() was last run
-    
-    def update(self, keyEvent):
-        """Take an event and and updates the lists of keys accordingly."""
-        self.newKeysList = [] # They are no longer new
-        self.freshKeysList = [] # They are no longer fresh
-
-        if keyEvent.type == ecodes.EV_KEY: # If the event is a related to a key, as opposed to a mouse movement or something (At least I think thats what this does)
-            keyEvent = categorize(keyEvent) # Convert our EV_KEY input event into a KeyEvent
-            keycode = keyEvent.keycode # Cache value that we are about to use a lot
-            keystate = keyEvent.keystate
-
-            if keystate == keyEvent.key_down or keystate == keyEvent.key_hold: # If a new key has been pressed or a key we might have missed the down event for is being held
-                if not keycode in self.keysList: # If this key (which is held) is not in our list of keys that are held
-                    # print(f"New key tracked: {keycode}")
-                    self.keysList += [keycode, ] # Add list of our (one) keycode to list of held keys
-                    self.newKeysList += [keycode, ] # and to our list of newly held keys
-
-            elif keystate == keyEvent.key_up: # If a key has been released
-                if keycode in self.keysList: # And if we have that key marked as held
-                    # print(f"Tracked key {keycode} released.")
-                    self.keysList.remove(keycode) # Then we remove it from our list of held keys
+        self.keys = {} # A dict with the scancodes of keys being held as keys, used as a set that remembers the order keys were pressed in
+        self.newKeys = () # A tuple of the scancodes of keys that were newly held when update() was last run
+        self.freshKeys = None # The chord of keys being held, None unless a new key was pressed when update() was last run
+        self.releasedKeys = () # A tuple of the scancodes of keys that were released when update() was last run
 
-                else:
-                    print(f"Untracked key {keycode} released.") # If you see this that means we missed a key press, bad news. (But not to fatal.)
+    def update(self, keyEvents):
+        """Take a frame of events (everything up to a SYN_REPORT) and updates the held keys accordingly."""
+        newKeys = []
+        releasedKeys = []
 
-            if settings["multiKeyMode"] == "combination":
-                self.keysList.sort()
-                self.newKeysList.sort()
+        for keyEvent in keyEvents:
+            if keyEvent.type != ecodes.EV_KEY: # If the event isn't related to a key, as opposed to a mouse movement or something
+                continue
+
+            scancode = keyEvent.code
+            keystate = keyEvent.value # 1 is down, 2 is held and 0 is up
 
-            if not self.newKeysList == []: # If new keys have pressed
-                self.freshKeysList = self.keysList # Set fresh keys equal to helf keys
-                # print(f"New keys are: {self.newKeysList}") # Print debug info
-                # print(f"Fresh keys are: {self.freshKeysList}")
+            if keystate == 1 or keystate == 2: # If a new key has been pressed or a key we might have missed the down event for is being held
+                if not scancode in self.keys: # If this key (which is held) is not among the keys that are held
+                    self.keys[scancode] = None # Add it to our held keys
+                    newKeys.append(scancode) # and to our newly held keys
+
+            elif keystate == 0: # If a key has been released
+                if scancode in self.keys: # And if we have that key marked as held
+                    del self.keys[scancode] # Then we remove it from our held keys
+                    releasedKeys.append(scancode)
+
+                else:
+                    print(f"Untracked key {keyName(scancode)} released.") # If you see this that means we missed a key press, bad news. (But not to fatal.)
+
+        self.newKeys = tuple(newKeys) # Keys from earlier frames are no longer new
+        self.releasedKeys = tuple(releasedKeys)
+        self.freshKeys = self.getList() if newKeys else None # And are only fresh if this frame pressed something, however many keys it pressed
 
     def getList(self, returnType = 0):
-        """Returns the list of held keys in different forms based on returnType.
-        
+        """Returns the held keys in different forms based on returnType.
+
         returnType values :
-        0 - Returns the list as it is stored, as a list of strings.
-        1 - Returns a single string with keycodes separated by \"+\"s, for use when reading/writing a layer json file.        
+        0 - Returns the keys as a chord, a frozenset of scancodes (or a tuple in press order when multiKeyMode is \"sequence\") to look up in a compiled layer.
+        1 - Returns a single string with keycodes separated by \"+\"s, for use when reading/writing a layer json file.
         """
-        if returnType == 0: # If we just want the list
-            return self.keysList # Return it
+        if returnType == 0: # If we want a chord
+            if settings["multiKeyMode"] == "combination":
+                return frozenset(self.keys)
 
-        elif returnType == 1: # If we want a string 
-            keyListParsed = ""
-            
-            for keycode in self.keysList:
-                keyListParsed += keycode # Build the string out of keycodes
-                
-                if not keycode is self.keysList[-1]: # If this isn't the last keycode
-                    keyListParsed += "+" # Add a + to separate it from the previous keycode
+            return tuple(self.keys)
 
-            return keyListParsed # Return the parsed string 
+        elif returnType == 1: # If we want a string
+            return chordString(self.getList())
 
         else: # If we don't recognize the return type
             print(f"Unrecognized value for returnType: {returnType}, returning None, expect errors!") # Say so
             return None
 
     def getNew(self, returnType = 0):
-        """Returns the list of newly held keys in different forms based on returnType.
-        
+        """Returns the newly held keys in different forms based on returnType.
+
         returnType values :
-        0 - Returns the list as it is stored, as a list of strings.
-        1 - Returns a single string with keycodes separated by \"+\"s, for use when reading/writing a layer json file.        
+        0 - Returns a tuple of scancodes.
+        1 - Returns a single string with keycodes separated by \"+\"s, for use when reading/writing a layer json file.
         """
-        if returnType == 0: # If we just want the list
-            return self.newKeysList # Return it
-
-        elif returnType == 1: # If we want a string 
-            keyListParsed = ""
-            
-            for keycode in self.newKeysList:
-                keyListParsed += keycode # Build the string out of keycodes
-                
-                if not keycode is self.newKeysList[-1]: # If this isn't the last keycode
-                    keyListParsed += "+" # Add a + to separate it from the previous keycode
+        if returnType == 0: # If we just want the tuple
+            return self.newKeys # Return it
 
-            return keyListParsed # Return the parsed string 
+        elif returnType == 1: # If we want a string
+            return chordString(self.newKeys)
 
         else: # If we don't recognize the return type
             print(f"Unrecognized value for returnType: {returnType}, returning None, expect errors!") # Say so
             return None
 
     def getFresh(self, returnType = 0):
-        """Returns the fresh (empty unless new keys were added last update()) list of held keys in different forms based on returnType.
-        
+        """Returns the fresh (None unless new keys were added last update()) held keys in different forms based on returnType.
+
         returnType values :
-        0 - Returns the list as it is stored, as a list of strings.
-        1 - Returns a single string with keycodes separated by \"+\"s, for use when reading/writing a layer json file.        
+        0 - Returns the keys as a chord, as getList() does.
+        1 - Returns a single string with keycodes separated by \"+\"s, for use when reading/writing a layer json file.
         """
-        if returnType == 0: # If we just want the list
-            return self.freshKeysList # Return it
+        if returnType == 0: # If we want a chord
+            return self.freshKeys # Return it
 
-        elif returnType == 1: # If we want a string 
-            keyListParsed = ""
-            
-            for keycode in self.freshKeysList:
-                keyListParsed += keycode # Build the string out of keycodes
-                
-                if not keycode is self.freshKeysList[-1]: # If this isn't the last keycode
-                    keyListParsed += "+" # Add a + to separate it from the previous keycode
+        elif returnType == 1: # If we want a string
+            if self.freshKeys is None:
+                return ""
 
-            return keyListParsed # Return the parsed string 
+            return chordString(self.freshKeys)
 
         else: # If we don't recognize the return type
             print(f"Unrecognized value for returnType: {returnType}, returning None, expect errors!") # Say so
             return None
 
+def keyName(scancode): # Returns the keycode (e.g. "KEY_A") of a scancode, for display and for writing layer json files
+    name = ecodes.bytype[ecodes.EV_KEY].get(scancode, f"KEY_{scancode}")
+
+    if isinstance(name, (list, tuple)): # Some scancodes have more than one keycode
+        return [alias for alias in name if alias != "KEY_MIN_INTERESTING"][0] # Any of them will parse back to the same scancode, but KEY_MUTE is friendlier than KEY_MIN_INTERESTING
+
+    return name
+
+def chordString(chord): # Returns a chord (or any collection of scancodes) as keycodes separated by "+"s, as used in layer json files
+    names = [keyName(scancode) for scancode in chord]
+
+    if isinstance(chord, frozenset): # Combinations have no order, so sort them to keep layer files tidy
+        names.sort()
+
+    return "+".join(names)
+
+def keyCode(keycode): # Returns the scancode of a keycode (e.g. "KEY_A" or "BTN_LEFT"), or None if it isn't a known key
+    keycode = keycode.strip()
+
+    if not (keycode.startswith("KEY_") or keycode.startswith("BTN_")): # ecodes.ecodes also has every other kind of event, REL_Y would be KEY_ESC's scancode
+        return None
+
+    return ecodes.ecodes.get(keycode)
+
+def parseChord(keycodes): # Returns the chord for a string of keycodes separated by "+"s, or None if any of them isn't a known key
+    scancodes = []
+
+    for keycode in keycodes.split("+"):
+        scancode = keyCode(keycode)
+
+        if scancode is None: # If this isn't a key evdev knows about
+            return None
+
+        scancodes.append(scancode)
+
+    if settings["multiKeyMode"] == "combination":
+        return frozenset(scancodes)
+
+    return tuple(scancodes)
+
+class sequenceNode():
+    """A class for a node of a compiled layer, a trie of chords in which every path from the root is a sequence of chords pressed one after another."""
+    def __init__(self):
+        self.children = {} # A dict of the chords that can be pressed next to the sequenceNodes they lead to
+        self.partials = set() # A set of chords that are only part of the way to one of our children's chords, which shouldn't break a sequence
+        self.value = None # The command bound to the sequence ending here, if any
+        self.keycodes = None # That binding as it is written in the layer json file
+        self.timeout = 0 # How many seconds to wait for the next chord before giving up on longer sequences
+        self.gestures = {} # A dict of "hold", "double" and "repeat" to the (keycodes, command) bound to holding, double tapping or repeating the chord ending here, see processGesture()
+
+gestureNames = ("tap", "hold", "double", "repeat") # The ways a binding's last chord can be pressed, besides just pressing it
+
+def parseBinding(keycodes): # Returns a list of the chords in a binding as written in a layer json file, the timeout in seconds between them and how its last chord is pressed (None for a plain press), raising a ValueError if it can't be parsed
+    steps, _, timeout = keycodes.partition("@") # Bindings may end with @<milliseconds> to set their own timeout between steps
+    steps, _, gesture = steps.partition(":") # And the last step may end with :tap, :hold, :double or :repeat
+
+    if gesture and not gesture in gestureNames:
+        raise ValueError(f"\"{gesture}\" is not one of {', '.join(gestureNames)}")
+
+    try:
+        timeout = int(timeout) / 1000 if timeout else settings["sequenceTimeout"] / 1000
+
+    except ValueError:
+        raise ValueError(f"\"{timeout}\" is not a timeout in milliseconds")
+
+    chords = [parseChord(step) for step in steps.split(",")] # Steps of a sequence are separated by ","s
+
+    if None in chords:
+        raise ValueError("it contains an unknown keycode")
+
+    return chords, timeout, gesture or None
+
+def compileLayer(layer, filename = "layer"): # Returns the root sequenceNode of a trie built from a dict of keycode strings to commands, as read from a layer json file
+    root = sequenceNode()
+
+    for keycodes, value in layer.items():
+        try:
+            chords, timeout, gesture = parseBinding(keycodes)
+
+        except ValueError as error:
+            print(f"Ignoring binding \"{keycodes}\" in {filename}, {error}") # Warn the user, once, when the layer is loaded
+            continue
+
+        node = root
+        for chord in chords: # Walk (and grow) the trie along the sequence
+            node.timeout = max(node.timeout, timeout) # A node shared by several sequences waits as long as the most patient of them
+
+            if not chord in node.children:
+                node.children[chord] = sequenceNode()
+
+                if isinstance(chord, frozenset): # Any smaller set of the chord's keys might be held on the way to it
+                    for size in range(1, len(chord)):
+                        node.partials.update(frozenset(partial) for partial in itertools.combinations(chord, size))
+
+                else: # In sequence mode only the keys pressed first can be
+                    node.partials.update(chord[:size] for size in range(1, len(chord)))
+
+            node = node.children[chord]
+
+        if gesture is None or gesture == "tap": # A chord's plain binding is its tap once it has gestures, so they share a slot
+            node.value = value
+            node.keycodes = keycodes
+
+        else:
+            node.gestures[gesture] = (keycodes, value)
+
+    nodes = [root]
+    while nodes: # Look for chords with gestures that longer sequences carry on from, which processKeycode() never waits for
+        node = nodes.pop()
+
+        if "repeat" in node.gestures: # Repeating runs on every press, so nothing else bound to the chord ever can
+            repeatKeycodes = node.gestures["repeat"][0]
+            shadowed = [node.keycodes] if node.value is not None else []
+            shadowed += [keycodes for gesture, (keycodes, value) in node.gestures.items() if gesture != "repeat"]
+
+            for keycodes in sorted(shadowed):
+                print(f"Ignoring binding \"{keycodes}\" in {filename}, {repeatKeycodes} repeats whenever it is pressed") # Warn the user, once, when the layer is loaded
+
+            node.value = None
+            node.keycodes = None
+            node.gestures = {"repeat": node.gestures["repeat"]}
+
+        if node.gestures and node.children:
+            gestureKeycodes = ", ".join(sorted(keycodes for keycodes, value in node.gestures.values()))
+            shadowed = []
+            below = list(node.children.values())
+
+            while below:
+                child = below.pop()
+                shadowed += [child.keycodes] if child.value is not None else []
+                shadowed += [keycodes for keycodes, value in child.gestures.values()]
+                below.extend(child.children.values())
+
+            for keycodes in sorted(shadowed):
+                print(f"Ignoring binding \"{keycodes}\" in {filename}, it continues past {gestureKeycodes}, which can't be followed by more keys") # Warn the user, once, when the layer is loaded
+
+            node.children = {} # Nothing below can ever be reached
+            node.partials = set()
+
+        nodes.extend(node.children.values())
+
+    return root
+
+class layerNode():
+    """A class for a compiled layer, which keyboards point at while they are on it."""
+    def __init__(self, name):
+        self.name = name # The layer's json filename
+        self.root = sequenceNode() # The root of the layer's compiled trie of bindings, see compileLayer()
+        self.targets = set() # A set of the json filenames of layers this layer's layer: bindings switch to
+        self.stamp = None # The (mtime, size) of the file when we last loaded it
+
+class layerGraph():
+    """A class for every layer in /layers, loaded and compiled up front so that switching layers never touches the disk."""
+    def __init__(self):
+        self.layers = {} # A dict of json filenames to layerNodes
+
+    def load(self, name):
+        """(Re)loads the layer json file name into its layerNode, in place so keyboards on it see the change, and returns the node."""
+        node = self.layers.get(name)
+        if node is None:
+            node = self.layers[name] = layerNode(name)
+
+        try:
+            stat = os.stat(layerDir + name)
+            node.stamp = (stat.st_mtime_ns, stat.st_size) # The size catches rewrites that land within the filesystem's timestamp granularity
+
+            with open(layerDir + name) as f:
+                layer = json.load(f)
+
+        except (OSError, ValueError) as error: # If the file is missing or isn't valid json, keep whatever we had
+            print(f"Could not load layer file {name}: {error}")
+            return node
+
+        if not isinstance(layer, dict): # Valid json, but not an object of keycodes to commands
+            print(f"Could not load layer file {name}: it isn't an object of keycodes to commands")
+            return node
+
+        for keycodes, value in list(layer.items()):
+            if not isinstance(value, str):
+                print(f"Ignoring binding \"{keycodes}\" in {name}, its command isn't a string")
+                del layer[keycodes]
+
+            elif commandProblem(value) is not None:
+                print(f"Ignoring binding \"{keycodes}\" in {name}, {commandProblem(value)}")
+                del layer[keycodes]
+
+        node.root = compileLayer(layer, name) # Translate keycodes to scancodes here, once, rather than on every event
+        node.targets = {layerFilename(value.split(':')[-1]) for value in layer.values() if value.startswith("layer:")}
+
+        for keeb in keebs: # Any sequence or gesture in progress on this layer belongs to the old trie
+            if keeb.layer is node:
+                resetSequence(keeb)
+                resetGesture(keeb)
+
+        return node
+
+    def loadAll(self):
+        """Loads every layer json file in /layers and reports (and creates) any layer a layer: binding switches to that doesn't exist."""
+        for name in sorted(os.listdir(layerDir)):
+            if name.endswith(".json"):
+                self.load(name)
+
+        for node in list(self.layers.values()):
+            for target in sorted(node.targets):
+                if not target in self.layers:
+                    print(f"Layer file {node.name} switches to missing layer {target}, creating it")
+                    createLayer(target)
+                    self.load(target)
+
+    def get(self, name):
+        """Returns the layerNode for the layer json file name, creating the layer if it doesn't exist."""
+        node = self.layers.get(name)
+
+        if node is None: # Only for layers that appeared since loadAll(), or were never created
+            if os.path.exists(layerDir + name) == False: # If the layer has no json file
+                createLayer(name) # Create one
+                print("Created layer file: " + name) # Notify the user
+
+            node = self.load(name)
+
+        return node
+
+    def reload(self, name):
+        """Reloads the layer json file name if we have loaded it before, so our copy matches what was just written to it."""
+        if name in self.layers:
+            self.load(name)
+
+    def refresh(self):
+        """Reloads every layer json file that has changed on disk, and loads any new ones."""
+        for name in os.listdir(layerDir):
+            if not name.endswith(".json"):
+                continue
+
+            node = self.layers.get(name)
+
+            try:
+                stat = os.stat(layerDir + name)
+
+            except OSError: # If it vanished since we listed it
+                continue
+
+            if node is None or node.stamp != (stat.st_mtime_ns, stat.st_size):
+                print(f"{'Loading new' if node is None else 'Reloading changed'} layer file {name}")
+                self.load(name)
+
+class latencyHistogram():
+    """A class for summarizing durations in buckets that double in width, so recording one is cheap and memory use never grows."""
+    def __init__(self):
+        self.buckets = [0] * 32 # Bucket n counts durations of at least 2**(n-1) and under 2**n microseconds, the last also counts everything longer
+        self.count = 0
+        self.total = 0.0 # The sum of all durations in seconds, for the mean
+        self.max = 0.0
+
+    def record(self, seconds):
+        """Adds a duration in seconds to the histogram."""
+        seconds = max(seconds, 0.0) # Clocks can disagree slightly, a negative duration is just a very short one
+        self.buckets[min(int(seconds * 1000000).bit_length(), 31)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, fraction):
+        """Returns an upper bound in seconds on the duration below which fraction of recorded durations fall."""
+        target = fraction * self.count
+        seen = 0
+
+        for bucketIndex in range(0, len(self.buckets)):
+            seen += self.buckets[bucketIndex]
+
+            if seen > 0 and seen >= target:
+                return min(2 ** bucketIndex / 1000000, self.max) # The bucket's upper edge, but never more than we have seen
+
+        return 0.0
+
+    def summary(self):
+        """Returns a one line summary of the histogram in milliseconds."""
+        if self.count == 0:
+            return "count 0"
+
+        return (f"count {self.count}, mean {self.total / self.count * 1000:.3f}ms, p50 <{self.percentile(0.5) * 1000:.3f}ms, "
+            f"p90 <{self.percentile(0.9) * 1000:.3f}ms, p99 <{self.percentile(0.99) * 1000:.3f}ms, max {self.max * 1000:.3f}ms")
+
+class keebStats():
+    """A class for the counters and histograms describing what the event loop and the dispatcher have been doing."""
+    def __init__(self):
+        self.startTime = time.time()
+        self.lock = threading.Lock() # Guards histograms and exitCodes, which the dispatcher's workers also write to
+        self.counters = collections.Counter() # Only ever written by the event loop, so they need no lock
+        self.histograms = collections.defaultdict(latencyHistogram)
+        self.exitCodes = collections.Counter()
+
+    def count(self, name, amount = 1):
+        """Adds amount to the counter name, only to be called from the event loop."""
+        self.counters[name] += amount
+
+    def record(self, name, seconds):
+        """Adds a duration in seconds to the histogram name."""
+        with self.lock:
+            self.histograms[name].record(seconds)
+
+    def exited(self, status):
+        """Counts a command exiting with status (None if it couldn't be started)."""
+        with self.lock:
+            self.exitCodes[status] += 1
+
+    def report(self):
+        """Returns a human readable dump of every counter and histogram."""
+        lines = [f"Keebie stats after {time.time() - self.startTime:.0f}s:"]
+
+        for name in sorted(self.counters):
+            lines.append(f"  {name}: {self.counters[name]}")
+
+        with self.lock:
+            for name in sorted(self.histograms):
+                lines.append(f"  {name}: {self.histograms[name].summary()}")
+
+            if self.exitCodes:
+                lines.append("  exitCodes: " + ", ".join(f"{status}: {count}" for status, count in sorted(self.exitCodes.items(), key=str)))
+
+        return "\n".join(lines)
+
+def bindingName(binding): # Returns a (keyboard path, layer name, keycodes) binding as the dispatcher keys them in a readable form
+    path, layer, keycodes = binding
+    return f"{keycodes} in {layer} on {path}"
+
+class actionDispatcher():
+    """A class for running commands on a bounded pool of worker threads, so reading the keyboard never waits for a command to finish."""
+    def __init__(self, maxWorkers):
+        self.queue = queue.Queue() # A queue of (binding, command) tuples waiting for a free worker
+        self.lock = threading.Lock() # Guards busy and waiting, which are shared with the workers
+        self.busy = {} # A dict of bindings, (keyboard path, layer name, keycodes) tuples, to how many of their commands are queued or running
+        self.waiting = {} # A dict of bindings to deques of commands held back until the binding's previous command exits
+
+        for workerIndex in range(0, maxWorkers): # Start our workers, as daemons so they never keep us from exiting
+            threading.Thread(target=self.work, name=f"keebie-worker-{workerIndex}", daemon=True).start()
+
+    def submit(self, binding, command, policy, eventTime = None):
+        """Hands command off to the workers on behalf of binding, returns False if it was dropped. eventTime is the timestamp of the event that triggered the command, if known.
+
+        policy values :
+        queue - If the binding's previous command is still running, run this one after it exits.
+        drop - If the binding's previous command is still running, ignore this one.
+        parallel - Run this one as soon as a worker is free regardless.
+        """
+        with self.lock:
+            if self.busy.get(binding, 0) > 0 and policy != "parallel": # If this binding still has a command in flight
+                if policy == "drop":
+                    stats.count("commandsDropped")
+                    print(f"Dropped \"{command}\", the previous command for {bindingName(binding)} is still running")
+                    return False
+
+                self.waiting.setdefault(binding, collections.deque()).append(command) # Hold it until that command exits
+                return True
+
+            self.busy[binding] = self.busy.get(binding, 0) + 1
+
+        if eventTime is not None:
+            stats.record("dispatchLatency", time.time() - eventTime) # How long since the kernel saw the key that triggered this
+
+        self.queue.put((binding, command))
+        return True
+
+    def work(self):
+        """Runs commands from the queue forever, reaping each one and reporting failures."""
+        while True:
+            binding, command = self.queue.get()
+
+            startTime = time.monotonic()
+
+            try:
+                if callable(command): # If the command runs itself, like a pythonJob
+                    status = command()
+
+                else:
+                    process = subprocess.Popen(command, shell=True) # Launch the command
+                    status = process.wait() # And reap it once it's done
+
+            except OSError as error:
+                print(f"Failed to run \"{command}\": {error}")
+                status = None
+
+            stats.record("runTime", time.monotonic() - startTime)
+            stats.exited(status)
+
+            if status: # If the command failed or was killed
+                print(f"Command \"{command}\" for {bindingName(binding)} exited with status {status}")
+
+            with self.lock:
+                waiting = self.waiting.get(binding)
+
+                if waiting: # If this binding has commands held back, its turn passes to the next one
+                    nextCommand = waiting.popleft()
+                    if not waiting:
+                        del self.waiting[binding]
+
+                else:
+                    nextCommand = None
+                    self.busy[binding] -= 1
+                    if self.busy[binding] == 0:
+                        del self.busy[binding]
+
+            if nextCommand is not None:
+                self.queue.put((binding, nextCommand))
+
+            self.queue.task_done() # Only after queueing the next command, so queue.join() waits for held back commands too
+
+class pythonWorker():
+    """A class for a long-lived python interpreter (see servePython()) that runs scripts from /scripts without paying interpreter startup on every keypress."""
+    def __init__(self):
+        self.lock = threading.Lock() # Guards everything below, which every dispatcher worker uses
+        self.process = None # The worker's Popen, or None until the first script is run
+        self.pending = {} # A dict of request ids to [threading.Event, exit status] for scripts the worker is running
+        self.nextId = 0
+
+    def start(self):
+        """Launches a fresh worker, only to be called while holding lock."""
+        responseRead, responseWrite = os.pipe() # Responses get their own pipe so scripts can share our stdout
+        self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--python-worker", str(responseWrite)], stdin=subprocess.PIPE, pass_fds=(responseWrite, ))
+        os.close(responseWrite)
+
+        self.pending = {} # Anything still pending belongs to the old worker, which will fail it
+        threading.Thread(target=self.listen, args=(os.fdopen(responseRead), self.pending), name="keebie-python-worker", daemon=True).start()
+
+    def listen(self, responses, pending):
+        """Wakes up whoever is waiting on each script the worker reports as exited, and fails the rest if the worker dies."""
+        for line in responses:
+            response = json.loads(line)
+
+            with self.lock:
+                entry = pending.pop(response["id"], None)
+
+            if entry is not None:
+                entry[1] = response["status"]
+                entry[0].set()
+
+        print("Python worker exited, it will be restarted for the next script")
+        with self.lock:
+            for entry in pending.values(): # The scripts we were waiting on are lost with it
+                entry[0].set()
+
+            pending.clear()
+
+    def run(self, script, args):
+        """Runs script (a path) with args (a list of strings) in the worker, starting it if need be, and returns its exit status once it exits."""
+        entry = [threading.Event(), None]
+
+        with self.lock:
+            if self.process is None or self.process.poll() is not None: # If we have no worker or it died
+                self.start()
+
+            requestId = self.nextId
+            self.nextId += 1
+            self.pending[requestId] = entry
+
+            try:
+                self.process.stdin.write((json.dumps({"id": requestId, "script": script, "args": args}) + "\n").encode())
+                self.process.stdin.flush()
+
+            except OSError: # If the worker died under us
+                del self.pending[requestId]
+                return None
+
+        entry[0].wait()
+        return entry[1]
+
+class pythonJob():
+    """A class for a script for the pythonWorker, which the actionDispatcher calls in place of running a shell command."""
+    def __init__(self, script, args):
+        self.script = script
+        self.args = args
+
+    def __call__(self):
+        return warmPython.run(self.script, self.args)
+
+    def __str__(self):
+        return " ".join(["python3", self.script] + self.args)
+
+def servePython(responseFd): # Runs scripts requested on stdin by a pythonWorker, forking this warm interpreter for each, and reports their exit statuses to responseFd
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # Ctrl+C is for the main process, we exit when it closes our stdin
+    responses = os.fdopen(responseFd, "w", buffering=1)
+    compiled = {} # A dict of script paths to tuples of the mtime they were compiled at and their code objects
+    children = {} # A dict of pids of running scripts to their request ids
+
+    def compileScript(path): # Returns the code object for the script at path, compiling it only if it changed since we last did
+        mtime = os.stat(path).st_mtime_ns
+
+        if not path in compiled or compiled[path][0] != mtime:
+            with open(path, "rb") as f:
+                compiled[path] = (mtime, compile(f.read(), path, "exec"))
+
+        return compiled[path][1]
+
+    if os.path.isdir(scriptDir): # Compile every script up front, so even the first press of each is fast
+        for scriptName in os.listdir(scriptDir):
+            if scriptName.endswith(".py"):
+                try:
+                    compileScript(scriptDir + scriptName)
+
+                except (OSError, SyntaxError, ValueError):
+                    pass # It'll be reported if it's ever run
+
+    wakeupRead, wakeupWrite = os.pipe() # Signals write to this, so select() wakes when a script exits
+    os.set_blocking(wakeupRead, False)
+    os.set_blocking(wakeupWrite, False)
+    signal.set_wakeup_fd(wakeupWrite)
+    signal.signal(signal.SIGCHLD, lambda signalNumber, frame: None)
+
+    selector = selectors.DefaultSelector()
+    selector.register(sys.stdin.fileno(), selectors.EVENT_READ)
+    selector.register(wakeupRead, selectors.EVENT_READ)
+    buffered = b""
+
+    while True:
+        for key, mask in selector.select():
+            if key.fd == wakeupRead:
+                try:
+                    os.read(wakeupRead, 512) # Drain it, we reap below regardless
+
+                except BlockingIOError:
+                    pass
+                continue
+
+            data = os.read(sys.stdin.fileno(), 65536)
+            if data == b"": # If the main process has gone
+                return
+
+            buffered += data
+            *lines, buffered = buffered.split(b"\n")
+
+            for line in lines:
+                request = json.loads(line)
+
+                try:
+                    code = compileScript(request["script"])
+
+                except (OSError, SyntaxError, ValueError) as error:
+                    print(f"Failed to load python script {request['script']}: {error}", file=sys.stderr)
+                    responses.write(json.dumps({"id": request["id"], "status": None}) + "\n")
+                    continue
+
+                pid = os.fork()
+                if pid == 0: # In the child, which is isolated from every other run by being its own process
+                    signal.set_wakeup_fd(-1)
+                    signal.signal(signal.SIGINT, signal.SIG_DFL)
+                    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+
+                    devNull = os.open(os.devnull, os.O_RDONLY) # Our stdin is the request pipe, which a script reading its stdin mustn't block on or eat requests from
+                    os.dup2(devNull, sys.stdin.fileno())
+                    os.close(devNull)
+
+                    for fd in (responseFd, wakeupRead, wakeupWrite): # Nor should it hold on to our other pipes
+                        os.close(fd)
+
+                    sys.argv = [request["script"]] + request["args"]
+                    sys.path[0] = os.path.dirname(request["script"]) # Let the script import its neighbours, like it could if python3 had run it
+                    status = 0
+
+                    try:
+                        exec(code, {"__name__": "__main__", "__file__": request["script"]})
+
+                    except SystemExit as exit:
+                        status = exit.code if isinstance(exit.code, int) else (0 if exit.code is None else 1)
+
+                    except BaseException:
+                        traceback.print_exc()
+                        status = 1
+
+                    sys.stdout.flush()
+                    sys.stderr.flush()
+                    os._exit(status)
+
+                children[pid] = request["id"]
+
+        while children: # Reap every script that has exited
+            pid, waitStatus = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                break
+
+            if pid in children:
+                responses.write(json.dumps({"id": children.pop(pid), "status": os.waitstatus_to_exitcode(waitStatus)}) + "\n")
+
+class benchmarkDispatcher():
+    """A class standing in for actionDispatcher during benchmarks, recording how long each command took to reach it instead of running it."""
+    def __init__(self):
+        self.latencies = [] # A list of seconds between an event's timestamp and the command it triggered being submitted
+
+    def submit(self, binding, command, policy, eventTime = None):
+        """Records the latency of command, see actionDispatcher.submit()."""
+        if eventTime is not None:
+            self.latencies.append(time.time() - eventTime)
+
+        return True
+
+class replayDevice():
+    """A class that stands in for an InputDevice, replaying events recorded with --record."""
+    def __init__(self, path, realtime = True):
+        self.path = path
+        self.realtime = realtime # Whether to keep the recorded gaps between events, or replay them as fast as possible on a virtual clock
+        self.events = [] # A list of (timestamp, type, code, value) tuples
+
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+
+                if line == "" or line.startswith("#"): # Skip blank lines and comments
+                    continue
+
+                timestamp, eventType, code, value = line.split()
+                self.events.append((float(timestamp), int(eventType), int(code), int(value)))
+
+    def grab(self):
+        pass # Nobody else is reading a recording
+
+    def ungrab(self):
+        pass
+
+    def close(self):
+        pass
+
+    def active_keys(self):
+        return [] # A recording has no state beyond its events
+
+    async def async_read_batches(self):
+        """Yields the recorded events as lists of InputEvents, a SYN_REPORT frame at a time, stamped with the time they are replayed at like the kernel would."""
+        if self.events == []:
+            return
+
+        loop = asyncio.get_running_loop() # Whose clock is virtual when we aren't replaying in real time, see runReplay()
+        startTime = loop.time()
+        firstTimestamp = self.events[0][0]
+        batch = []
+
+        for timestamp, eventType, code, value in self.events:
+            if batch == []: # Wait for each frame's first event
+                delay = startTime + (timestamp - firstTimestamp) - loop.time()
+
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            now = time.time()
+            batch.append(evdev.InputEvent(int(now), int((now % 1) * 1000000), eventType, code, value))
+
+            if eventType == ecodes.EV_SYN and code == ecodes.SYN_REPORT:
+                yield batch
+                batch = []
+
+        if batch != []:
+            yield batch
+
+class virtualClockSelector(selectors.DefaultSelector):
+    """A class for a selector that, instead of waiting for a timeout, moves its clock (which its event loop reads, see runReplay()) on by it, so timers fire in order as fast as possible."""
+    def __init__(self):
+        super().__init__()
+        self.now = 0.0 # The virtual time in seconds
+
+    def select(self, timeout = None):
+        events = super().select(0) # Anything that is already ready is still handled straight away
+
+        if events == [] and timeout is not None and timeout > 0: # If the loop would sleep until its next timer
+            self.now += timeout # Skip straight to it
+
+        elif events == [] and timeout is None: # If there's no timer at all, only something outside the loop can wake us
+            events = super().select(None)
+
+        return events
+
+def runReplay(device): # Runs replayDevices(device) to completion, on a virtual clock unless device keeps its recorded timing, so sequence timeouts and gestures behave the same either way
+    if device.realtime:
+        asyncio.run(replayDevices(device))
+        return
+
+    selector = virtualClockSelector()
+    loop = asyncio.SelectorEventLoop(selector)
+    loop.time = lambda: selector.now # The loop schedules and fires its timers by this clock
+
+    try:
+        loop.run_until_complete(replayDevices(device))
+        loop.run_until_complete(loop.shutdown_asyncgens())
+
+    finally:
+        loop.close()
+
+class batchInputDevice():
+    """A class wrapping an InputDevice so that it hands over everything the kernel has queued for it in one read."""
+    def __init__(self, path):
+        self.device = evdev.InputDevice(path)
+
+    def __getattr__(self, name): # Anything else is the InputDevice's business
+        return getattr(self.device, name)
+
+    async def async_read_batches(self):
+        """Yields lists of every InputEvent available each time the device becomes readable."""
+        loop = asyncio.get_running_loop()
+        readable = asyncio.Event()
+        loop.add_reader(self.fd, readable.set) # Wake us whenever the kernel has events for us
+
+        try:
+            while True:
+                await readable.wait()
+                readable.clear()
+
+                try:
+                    batch = list(self.read()) # One syscall for however many events are waiting
+
+                except BlockingIOError: # If someone beat us to them
+                    continue
+
+                yield batch
+
+        finally:
+            loop.remove_reader(self.fd)
+
+def recordDevice(device, path): # Writes every event from device to path in the format replayDevice reads, until interrupted
+    signal.signal(signal.SIGINT, signal_handler)
+    print(f"Recording {device.path} to {path}, press Ctrl+C to stop")
+
+    with open(path, "w") as f:
+        f.write("# timestamp type code value\n")
+
+        for event in device.read_loop():
+            f.write(f"{event.timestamp():.6f} {event.type} {event.code} {event.value}\n")
+
+def percentile(samples, fraction): # Returns the value below which fraction of the sorted list samples falls
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+class keebDevice():
+    """A class for a keyboard we read macros from, each with its own keyLedger and active layer."""
+    def __init__(self, path, layer):
+        self.path = path # The path to the keyboard's device file
+        self.defaultLayer = layer # The layer json file we start on whenever the keyboard is attached
+        self.layer = None # The layerNode we are currently reading this keyboard's bindings from, set when it is attached
+        self.ledger = keyLedger()
+        self.device = None # The keyboard's InputDevice, or None while it is not attached
+        self.task = None # The asyncio task reading the keyboard while it is attached
+        self.paused = False # Whether we have let go of the keyboard and are ignoring it, see the control socket's pause command
+        self.retryDelay = 0 # How many seconds we last waited before retrying to attach the keyboard after failing to, 0 since it last attached
+        self.retryTime = 0 # The time.monotonic() before which we won't try to attach it again
+        self.sequence = None # The sequenceNode we have reached partway through a sequence, or None
+        self.sequenceTimer = None # The asyncio TimerHandle that will give up on that sequence
+        self.gesture = None # The sequenceNode with gestures whose chord we are waiting to see held, released or pressed again, or None
+        self.gestureChord = None # That chord
+        self.gestureHeld = False # Whether that chord is still held
+        self.gestureTimer = None # The asyncio TimerHandle that will decide the gesture if nothing else does first
+
 def signal_handler(signal, frame):
     sys.exit(0)
 
@@ -153,21 +907,143 @@ def config(): # Open the config file and return a list of it's line with leading
 def writeConfig(lineNum, data): # Writes some data to a line of the config file
     lines = open(filePath+'config', 'r').readlines()
     lines[lineNum] = data.strip() + "\n" # Ensure the data we are write will not interfere later lines
-    out = open(filePath+'config', 'w')
-    out.writelines(lines)
-    out.close()
 
-parser = argparse.ArgumentParser() # Set up command line arguments
-parser.add_argument("--layers", help="Show saved layer files", action="store_true")
-parser.add_argument("--device", help="Change target device")
-parser.add_argument("--add", help="Add new keys", action="store_true")
-parser.add_argument("--settings", help="Edits settings file", action="store_true")
-args = parser.parse_args()
+    tempPath = stageFile(filePath + 'config', "".join(lines)) # Write the new config next to the old one
+    os.replace(tempPath, filePath + 'config') # Then swap it in atomically, so a crash can never leave us with a truncated config
+
+virtualKeyboard = None # Our UInput for keys: and text: bindings, if we could open one
+
+textKeys = { # A dict of characters to the keycodes that type them on a US layout, besides letters and digits
+    " ": "KEY_SPACE", "\n": "KEY_ENTER", "\t": "KEY_TAB", "-": "KEY_MINUS", "=": "KEY_EQUAL", "[": "KEY_LEFTBRACE", "]": "KEY_RIGHTBRACE",
+    "\\": "KEY_BACKSLASH", ";": "KEY_SEMICOLON", "'": "KEY_APOSTROPHE", "`": "KEY_GRAVE", ",": "KEY_COMMA", ".": "KEY_DOT", "/": "KEY_SLASH"
+}
+
+shiftedTextKeys = { # A dict of characters to the keycodes that type them with shift held on a US layout, besides capital letters
+    "!": "KEY_1", "@": "KEY_2", "#": "KEY_3", "$": "KEY_4", "%": "KEY_5", "^": "KEY_6", "&": "KEY_7", "*": "KEY_8", "(": "KEY_9", ")": "KEY_0",
+    "_": "KEY_MINUS", "+": "KEY_EQUAL", "{": "KEY_LEFTBRACE", "}": "KEY_RIGHTBRACE", "|": "KEY_BACKSLASH", ":": "KEY_SEMICOLON", "\"": "KEY_APOSTROPHE",
+    "~": "KEY_GRAVE", "<": "KEY_COMMA", ">": "KEY_DOT", "?": "KEY_SLASH"
+}
+
+def openVirtualKeyboard(): # Opens the UInput keys: and text: bindings type through, once, so no binding has to
+    global virtualKeyboard
+
+    try:
+        virtualKeyboard = evdev.UInput(name="keebie") # A virtual keyboard that can press any key
+
+    except Exception as error: # evdev raises its own UInputError as well as OSErrors
+        print(f"Could not open a virtual keyboard, keys: and text: bindings won't work: {error}")
+
+def parseKeys(keycodes): # Returns a list of tuples of scancodes, one per tap, for keycodes separated by "+"s within a tap and ","s between taps, or None if any isn't a known key
+    taps = []
+
+    for tap in keycodes.split(","):
+        scancodes = tuple(keyCode(keycode) for keycode in tap.split("+"))
+
+        if None in scancodes:
+            return None
+
+        taps.append(scancodes)
+
+    return taps
+
+def commandProblem(value): # Returns why a binding's command can't be run, or None if it can be, for commands we can check before they are pressed
+    if value.split(':')[0] in settingsPossible["busyPolicy"]: # Look past any policy
+        value = value.split(':', 1)[1]
+
+    if value.startswith("keys:") and parseKeys(value.split(':', 1)[1]) is None:
+        return "its keys: contain an unknown keycode"
+
+    return None
+
+def textTaps(text): # Returns a list of tuples of scancodes, one per tap, that type text, skipping characters we don't know how to type
+    taps = []
+
+    for character in text:
+        if character.isascii() and character.isalnum():
+            keycode = "KEY_" + character.upper()
+            shifted = character.isupper()
+
+        elif character in textKeys:
+            keycode = textKeys[character]
+            shifted = False
+
+        elif character in shiftedTextKeys:
+            keycode = shiftedTextKeys[character]
+            shifted = True
+
+        else:
+            print(f"Can't type \"{character}\", skipping it")
+            continue
+
+        if shifted:
+            taps.append((ecodes.KEY_LEFTSHIFT, ecodes.ecodes[keycode]))
+
+        else:
+            taps.append((ecodes.ecodes[keycode], ))
+
+    return taps
+
+def emitTaps(taps): # Presses then releases each tuple of scancodes in taps on our virtual keyboard
+    for tap in taps:
+        for scancode in tap: # Press the keys in order
+            virtualKeyboard.write(ecodes.EV_KEY, scancode, 1)
+        virtualKeyboard.syn()
+
+        for scancode in reversed(tap): # And release them the other way round, so modifiers wrap the keys they modify
+            virtualKeyboard.write(ecodes.EV_KEY, scancode, 0)
+        virtualKeyboard.syn()
+
+warmPython = None # Our pythonWorker, if the pythonWorker setting is on
+
+stats = keebStats() # Our counters and histograms, dumped on SIGUSR1
+
+def dumpStats(): # Prints our stats
+    print(stats.report())
+
+keebs = [] # A list of keebDevices for every keyboard we are serving, the first is the one in config
+
+def switchLayer(layer, keeb): # Makes layer (a json filename in /layers) the active layer of keeb, creating it if it doesn't exist
+    resetSequence(keeb) # Any sequence or gesture in progress belongs to the old layer
+    resetGesture(keeb)
+    keeb.layer = loadedLayers.get(layer) # Layers are compiled up front, so a switch is just pointing at another one
+    print(f"Switched {keeb.path} to layer file: {layer}") # Notify the user
+
+def saveLayer(): # Persists the active layer of our first keyboard to the second line of config and returns its name
+    keeb = keebs[0]
+    layer = keeb.layer.name if keeb.layer is not None else keeb.defaultLayer # Until the keyboard attaches, it is still on the layer it will start from
+
+    writeConfig(1, layer)
+    print("Saved layer file: " + layer + " to config") # Notify the user
+    return layer
+
+socketPath = os.environ["XDG_RUNTIME_DIR"] + "/keebie.sock" if "XDG_RUNTIME_DIR" in os.environ else f"/tmp/keebie-{os.getuid()}.sock" # The path to the Unix socket a running keebLoop takes commands on, /tmp is shared so there it is per user
+servingControl = False # Whether socketPath is ours to remove when we exit
+
+def sendControl(words): # Sends a command (a list of words) to the running keebLoop's control socket and prints the response
+    import socket # Only --ctl needs it directly, so don't make every launch import it
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(socketPath)
+            client.sendall((shlex.join(words) + "\n").encode())
+            client.shutdown(socket.SHUT_WR)
+
+            response = b""
+            while True:
+                data = client.recv(65536)
+                if data == b"":
+                    break
+                response += data
+
+    except OSError as error: # If there is no running keebLoop to talk to
+        print(f"Couldn't reach Keebie at {socketPath}, is it running? ({error})")
+        sys.exit(1)
+
+    print(response.decode(), end="")
 
 layerDir = filePath + "/layers/" # Cache the full path to the /layers directory
 scriptDir = filePath + "/scripts/" # Cache the full path to the /scripts directory
 
-print("Welcome to Keebie")
+loadedLayers = layerGraph() # Every layer, compiled, so we don't read layer files on every event or layer switch
 
 def getLayers(): # Lists all the json files in /layers and thier contents
     print("Available Layers: \n")
@@ -182,46 +1058,240 @@ def getLayers(): # Lists all the json files in /layers and thier contents
     for i in layerFi:
         print(i+layerFi[i]) # And display thier contents to the user
 
-def addKey(keycodeTimeout = 1): # Shell for adding new macros
-    ledger = keyLedger() # Reset the keyLedger
+def addKey(device, layer = "default.json", keycodeTimeout = 1): # Shell for adding new macros to layer, read from device, all written at once when the user is done
+    newMacros = {} # The bindings the user has confirmed so far, keycodes to commands
+    signal.signal(signal.SIGINT, signal.default_int_handler) # Let Ctrl+C raise KeyboardInterrupt, so we can offer to keep what was added before it
 
-    command = input("Enter the command you would like to attribute to a key on your second keyboard \n") # Get the command the user wishs to bind
+    try:
+        while True:
+            ledger = keyLedger() # Reset the keyLedger
 
-    if command.startswith("layer:"): # If the user entered a layer switch command
-        if os.path.exists(command.split(':')[-1]+".json") == False: # Check if the layer json file exsits
-            createLayer(command.split(':')[-1]+".json") # If not create it
-            print("Created layer file: " + command.split(':')[-1]+".json") # And notify the user
+            command = input("Enter the command you would like to attribute to a key on your second keyboard \n") # Get the command the user wishs to bind
 
-    print(f"Please press the key combination you would like to assign the command to and hold it for {keycodeTimeout} seconds until the next prompt.")
+            print(f"Please press the key combination you would like to assign the command to and hold it for {keycodeTimeout} seconds until the next prompt.")
 
-    loopStartTime = None
-    signal.signal(signal.SIGINT, signal_handler)
-    for event in device.read_loop():
-        if loopStartTime == None: # because we don't want to start timing until the user has begun entering there key combiation
-            loopStartTime = time.time()
+            selector = selectors.DefaultSelector()
+            selector.register(device, selectors.EVENT_READ)
+            deadline = None
 
-        ledger.update(event) # Keep updateing the keyLedger with every new input
+            while deadline is None or time.monotonic() < deadline: # Until the time runs out, whether or not more keys arrive
+                if selector.select(None if deadline is None else deadline - time.monotonic()) == []:
+                    break
 
-        if not time.time() - loopStartTime < keycodeTimeout: # Unless the time runs out
-            break # Then we bear the loop
+                if deadline is None: # because we don't want to start timing until the user has begun entering there key combiation
+                    deadline = time.monotonic() + keycodeTimeout
 
-    inp = input(f"Assign {command} to [{ledger.getList(1)}]? [Y/n] ") # Ask the user if we (and they) got the command and binding right
-    if inp == 'Y' or inp == '': # If we did 
-        newMacro = {}
-        newMacro[ledger.getList(1)] = command
-        writeJson(config()[1], newMacro) # Write the binding into our layer json file
-        print(newMacro) # And print it back
+                for event in device.read(): # Keep updateing the keyLedger with every new input
+                    ledger.update((event, ))
 
-    else: # If we didn't
-        print("Addition cancelled.") # Confirm we have cancelled the binding
+            selector.close()
 
-    rep = input("Would you like to add another Macro? [Y/n] ") # Offer the user to add another binding
+            inp = input(f"Assign {command} to [{ledger.getList(1)}]? [Y/n] ") # Ask the user if we (and they) got the command and binding right
+            if inp == 'Y' or inp == '': # If we did
+                newMacros[ledger.getList(1)] = command # Hold on to the binding until the user is done
+                print({ledger.getList(1): command}) # And print it back
 
-    if rep == 'Y' or rep == '': # If they say yes
-        addKey() # Restart the shell
+            else: # If we didn't
+                print("Addition cancelled.") # Confirm we have cancelled the binding
+
+            rep = input("Would you like to add another Macro? [Y/n] ") # Offer the user to add another binding
+
+            if not (rep == 'Y' or rep == ''): # If they say no
+                break
+
+    except (KeyboardInterrupt, EOFError): # If the user stopped partway, or there is no more input
+        print()
+
+        if newMacros != {}:
+            try:
+                save = input(f"Save the {len(newMacros)} binding(s) added so far? [Y/n] ")
+
+            except EOFError: # If we can't ask, keep them, as they were confirmed one by one
+                save = ''
+
+            except KeyboardInterrupt: # A second Ctrl+C means no
+                save = 'n'
+
+            if not (save == 'Y' or save == ''):
+                print("Discarded the bindings added so far.")
+                newMacros = {}
+
+    if newMacros != {}:
+        try:
+            writeLayers({layer: newMacros}) # Write every binding into our layer json file in one go, creating any layers they switch to
+            print(f"Wrote {len(newMacros)} binding(s) to {layer}")
+
+        except ValueError as error:
+            print(f"Could not write your bindings, {error}")
+
+def layerFilename(name): # Returns the json filename of the layer name, which may or may not already end in .json
+    return name if name.endswith(".json") else name + ".json"
+
+def stageFile(path, text): # Writes text to a temporary file next to path and returns the temporary file's path, for os.replace() to swap in atomically
+    tempPath = path + ".tmp"
+
+    with open(tempPath, "w") as out:
+        out.write(text)
+        out.flush()
+        os.fsync(out.fileno()) # Make sure it is actually on disk before it replaces anything
+
+    return tempPath
+
+def validateBindings(batch): # Returns a list of problems with a dict of layer filenames to dicts of keycodes to commands, empty if it can all be written
+    problems = []
+
+    for layer, bindings in batch.items():
+        if os.path.exists(layerDir + layer): # We'll be adding to it, so it has to be a layer we can read
+            try:
+                if not isinstance(readJson(layer), dict):
+                    problems.append(f"{layer}: the file isn't an object of keycodes to commands")
+
+            except (OSError, ValueError) as error:
+                problems.append(f"{layer}: the file can't be read, {error}")
+
+        for keycodes, value in bindings.items():
+            if not isinstance(value, str):
+                problems.append(f"{layer}: \"{keycodes}\" has a command that isn't a string")
+                continue
+
+            try:
+                parseBinding(keycodes)
+
+            except ValueError as error:
+                problems.append(f"{layer}: \"{keycodes}\", {error}")
+
+            if commandProblem(value) is not None:
+                problems.append(f"{layer}: \"{keycodes}\", {commandProblem(value)}")
+
+    return problems
+
+def writeLayers(batch): # Adds a dict of layer filenames to dicts of keycodes to commands to those layers, with one atomic write per file, creating missing layers and any layers their layer: bindings switch to, raises a ValueError and writes nothing if validateBindings() finds problems
+    problems = validateBindings(batch)
+    if problems != []:
+        raise ValueError("; ".join(problems))
+
+    batch = dict(batch) # We add to it, so don't touch the caller's
+
+    for bindings in list(batch.values()):
+        for value in bindings.values():
+            if value.startswith("layer:"):
+                target = layerFilename(value.split(':')[-1])
+
+                if not target in batch and os.path.exists(layerDir + target) == False: # If the layer it switches to doesn't exist, create it along with everything else
+                    batch[target] = {}
+
+    staged = []
+    try:
+        for layer, bindings in batch.items():
+            if os.path.exists(layerDir + layer):
+                data = readJson(layer)
+
+            else:
+                data = {"KEY_ESC": "layer:default"} # The same as createLayer() would give us
+                print("Created layer file: " + layer)
+
+            data.update(bindings)
+            staged.append((stageFile(layerDir + layer, json.dumps(data, indent=3)), layerDir + layer, layer))
+
+    except BaseException: # If anything went wrong, nothing should change
+        for tempPath, path, layer in staged:
+            os.remove(tempPath)
+        raise
+
+    for tempPath, path, layer in staged: # Only once every file is safely written, swap them all in
+        os.replace(tempPath, path)
+        loadedLayers.reload(layer)
+
+def readBindings(path, fileFormat = None): # Returns a dict of layer filenames to dicts of keycodes to commands read from path ("-" for stdin), as json or csv
+    if path == "-":
+        text = sys.stdin.read()
 
     else:
-        exit()
+        with open(path) as f:
+            text = f.read()
+
+    if fileFormat is None: # Guess from the file name, or failing that the contents
+        if path.endswith(".csv"):
+            fileFormat = "csv"
+
+        elif path.endswith(".json") or text.lstrip().startswith(("{", "[")):
+            fileFormat = "json"
+
+        else:
+            fileFormat = "csv"
+
+    batch = {}
+
+    if fileFormat == "json": # {"layer": {"keycodes": "command", ...}, ...}
+        layers = json.loads(text)
+
+        if not isinstance(layers, dict):
+            raise ValueError("it isn't an object of layers to bindings")
+
+        for layer, bindings in layers.items():
+            if not isinstance(bindings, dict):
+                raise ValueError(f"the bindings for {layer} aren't an object of keycodes to commands")
+
+            batch.setdefault(layerFilename(layer), {}).update(bindings)
+
+    else: # layer,keycodes,command rows, optionally under a header
+        import csv # Only imports and exports need it
+
+        for row in csv.reader(text.splitlines()):
+            if row == [] or row == ["layer", "keycodes", "command"]: # Skip blank lines and the header
+                continue
+
+            if len(row) != 3:
+                raise ValueError(f"expected layer,keycodes,command but got {','.join(row)}")
+
+            batch.setdefault(layerFilename(row[0]), {})[row[1]] = row[2]
+
+    return batch
+
+def importBindings(path, fileFormat = None): # Validates all the bindings in path and, only if they are all good, writes them
+    try:
+        batch = readBindings(path, fileFormat)
+
+    except (OSError, ValueError) as error:
+        print(f"Could not read {path}: {error}")
+        sys.exit(1)
+
+    problems = validateBindings(batch)
+    if problems != []:
+        print("Nothing was imported, fix these bindings first:")
+        for problem in problems:
+            print("  " + problem)
+        sys.exit(1)
+
+    writeLayers(batch)
+    print(f"Imported {sum(len(bindings) for bindings in batch.values())} binding(s) into {len(batch)} layer(s)")
+
+def exportBindings(path, fileFormat = None): # Writes every binding in every layer to path ("-" for stdout), as json or csv
+    batch = {layer: readJson(layer) for layer in sorted(os.listdir(layerDir)) if layer.endswith(".json")}
+
+    if fileFormat is None:
+        fileFormat = "csv" if path.endswith(".csv") else "json"
+
+    if fileFormat == "json":
+        text = json.dumps(batch, indent=3) + "\n"
+
+    else:
+        import csv, io
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator="\n")
+        writer.writerow(["layer", "keycodes", "command"])
+
+        for layer, bindings in batch.items():
+            for keycodes, value in bindings.items():
+                writer.writerow([layer, keycodes, value])
+
+        text = out.getvalue()
+
+    if path == "-":
+        sys.stdout.write(text)
+
+    else:
+        os.replace(stageFile(path, text), path)
 
 def writeJson(filename, data, dir = layerDir): # Appends new data to a specified layer (or any json file named filename in the directory dir)
     with open(dir+filename) as f:
@@ -249,6 +1319,9 @@ def getSettings(): # Reads the json file specified on the third line of config a
 
     settingsFile = readJson(config()[2], filePath) # Get a dict of the keys and values in our settings file
     for setting in settings.keys(): # For every setting we expect to be in our settings file
+        if not setting in settingsFile: # If the settings file predates this setting
+            continue # Keep the default
+
         if settingsFile[setting] in settingsPossible[setting]: # If the value in our settings file is valid
             # print(f"Found valid value: \"{settingsFile[setting]}\" for setting: \"{setting}\"")
             settings[setting] = settingsFile[setting] # Write it into our settins
@@ -321,91 +1394,627 @@ def editSettings(): # Shell for editing settings
     else:
         exit()
 
-def processKeycode(keycode): # Given a keycode that might be in the layer json file, check if it is and execute the appropriate commands
-    if keycode in readJson(config()[1]): # If the keycode is in our layer's json file
-        value = readJson(config()[1])[keycode] # Get the instructions associated with the keycode
+def resetSequence(keeb): # Forgets any sequence keeb is partway through
+    if keeb.sequenceTimer is not None:
+        keeb.sequenceTimer.cancel()
 
-        if value.startswith("layer:"): # If value is a layerswitch command
-            if os.path.exists(layerDir+value.split(':')[-1] + ".json") == False: #if the layer has no json file
-                createLayer(value.split(':')[-1]+".json") # Create one
-                print("Created layer file: " + value.split(':')[-1]+".json") # Notify the user
-                writeConfig(1, value.split(':')[-1] + ".json") # Switch to our new layer file
-                print("Switched to layer file: " + value.split(':')[-1] + ".json") # Notify the user
+    keeb.sequence = None
+    keeb.sequenceTimer = None
 
-            else:
-                writeConfig(1, value.split(':')[-1] + ".json") # Switch the layer's json into our config
-                print("Switched to layer file: " + value.split(':')[-1] + ".json") # Notify the user
+def sequenceTimeout(keeb): # Called by the event loop when keeb waits too long for the next step of a sequence
+    node = keeb.sequence
+    keeb.sequence = None
+    keeb.sequenceTimer = None
+    stats.count("sequenceTimeouts")
 
-        if value.strip().endswith("&") == False and settings["forceBackground"]: # If value is not set in run in the background and our settings say to force running in the background
-            value += " &" # Force running in the background
-            
-        if value.strip().endswith("&") == False and settings["backgroundInversion"]: # If value is not set to run in the background and our settings say to invert background mode
-            value += " &" # Force running in the background
-        
-        elif value.strip().endswith("&") and settings["backgroundInversion"]: # Else if value is set to run in the background and our settings say to invert background mode
-            value = value.rstrip(" &") # Remove all spaces and &s from the end of value, there might be a better way but this is the best I've got
+    if node.value is not None: # If the keys pressed so far are a binding of their own
+        runBinding(node.keycodes, node.value, keeb) # It is the longest match we are going to get
 
-        if value.startswith("script:"): # If value is a bash file
-            print("Executing bash script: " + value.split(':')[-1])
-            os.system('bash ' + scriptDir + value.split(':')[-1])
+def processKeycode(chord, keeb, eventTime = None): # Given a chord that might be the next step of a sequence bound in keeb's layer, check if it is and execute the appropriate commands
+    if chord is None: # If no new keys were pressed (the frame only released keys, or held them) there is nothing to look up
+        stats.count("framesIgnored")
+        return
 
-        elif value.startswith("py:"): # If value is a generic python file
-            print("Executing python script: " + value.split(':')[-1])
-            os.system('python ' + scriptDir + value.split(':')[-1])
+    root = keeb.layer.root # Get our compiled layer
+    node = keeb.sequence or root # Carry on from where the last chord left us
+    nextNode = node.children.get(chord)
 
-        elif value.startswith("py2:"): # If value is a python2 file
-            print("Executing python2 script: " + value.split(':')[-1])
-            os.system('python2 ' + scriptDir + value.split(':')[-1])
+    if nextNode is None and node is not root: # If this chord doesn't continue the sequence we are partway through
+        if chord in node.partials: # Unless more keys may yet be added to it
+            return
 
-        elif value.startswith("py3:"): # If value is a python3 file
-            print("Executing python3 script: " + value.split(':')[-1])
-            os.system('python3 ' + scriptDir + value.split(':')[-1])
-        
-        elif value.startswith("exec:"): # If value is a generic executable
-            print("Executing file: " + value.split(':')[-1])
-            os.system(scriptDir + value.split(':')[-1])
+        resetSequence(keeb)
+
+        if node.value is not None: # If the keys pressed so far are a binding of their own, it is the longest match we are going to get
+            runBinding(node.keycodes, node.value, keeb, eventTime)
+
+        nextNode = root.children.get(chord) # This chord might still start a new sequence
+
+    if nextNode is None: # If the chord isn't bound in our layer
+        stats.count("chordMisses")
+
+        partOfGesture = keeb.gestureChord is not None and all(scancode in keeb.gestureChord for scancode in chord)
+        if not (chord in root.partials or partOfGesture): # A different chord means any tap we held back can't become a double tap, but keys on the way to a chord, like re-pressing its modifier, don't
+            finishGesture(keeb)
+
+    elif nextNode.gestures: # If how the chord is pressed matters, longer sequences can't follow it
+        resetSequence(keeb)
+        processGesture(nextNode, chord, keeb, eventTime)
+
+    elif nextNode.children: # If longer sequences could follow, wait for the next chord, up to a timeout
+        resetSequence(keeb)
+        keeb.sequence = nextNode
+        keeb.sequenceTimer = asyncio.get_running_loop().call_later(nextNode.timeout, sequenceTimeout, keeb)
+
+    else: # If the chord completes a binding
+        resetSequence(keeb)
+        finishGesture(keeb)
+        runBinding(nextNode.keycodes, nextNode.value, keeb, eventTime)
+
+def resetGesture(keeb): # Forgets any gesture keeb is partway through, without running anything
+    if keeb.gestureTimer is not None:
+        keeb.gestureTimer.cancel()
+
+    keeb.gesture = None
+    keeb.gestureChord = None
+    keeb.gestureHeld = False
+    keeb.gestureTimer = None
+
+def finishGesture(keeb): # Runs the tap we held back in case it became a double tap, if there is one, as something else was pressed
+    node = keeb.gesture
+
+    if node is not None and not keeb.gestureHeld and node.value is not None:
+        resetGesture(keeb)
+        runBinding(node.keycodes, node.value, keeb)
+
+    else:
+        resetGesture(keeb)
+
+def processGesture(node, chord, keeb, eventTime = None): # Starts telling apart a tap, hold, double tap or repeat of chord, which completes node, a binding with gestures
+    loop = asyncio.get_running_loop()
+
+    if keeb.gesture is node and not keeb.gestureHeld: # If this is the second press, inside the window we held the first tap back for
+        resetGesture(keeb)
+        stats.count("doubleTaps")
+        runBinding(*node.gestures["double"], keeb, eventTime)
+        return
+
+    finishGesture(keeb) # Anything we were waiting on before this press is decided now
+    keeb.gesture = node
+    keeb.gestureChord = chord
+    keeb.gestureHeld = True
+
+    if "repeat" in node.gestures: # Repeats run straight away, then again for as long as the chord is held
+        keeb.gestureTimer = loop.call_later(settings["holdTime"] / 1000, repeatGesture, keeb)
+        runBinding(*node.gestures["repeat"], keeb, eventTime)
+
+    elif "hold" in node.gestures: # If it can be held, it is a tap if it's released before holdTime and a hold if it isn't, otherwise it's a tap however long it's held
+        keeb.gestureTimer = loop.call_later(settings["holdTime"] / 1000, holdGesture, keeb)
+
+def releaseGesture(keeb): # Called when keeb's ledger releases keys, decides the gesture in progress if its chord is no longer held
+    node = keeb.gesture
+
+    if node is None or not keeb.gestureHeld or all(scancode in keeb.ledger.keys for scancode in keeb.gestureChord): # If nothing is waiting on a release, or every key of the chord is still held
+        return
+
+    if "repeat" in node.gestures or node.value is None: # If there's no tap to run, releasing it just ends the gesture
+        resetGesture(keeb)
+
+    elif "double" in node.gestures: # If it might yet be a double tap, hold the tap back until doubleTapTime passes without a second press
+        if keeb.gestureTimer is not None:
+            keeb.gestureTimer.cancel()
+
+        keeb.gestureHeld = False
+        keeb.gestureTimer = asyncio.get_running_loop().call_later(settings["doubleTapTime"] / 1000, finishGesture, keeb)
+
+    else:
+        resetGesture(keeb)
+        runBinding(node.keycodes, node.value, keeb)
+
+def holdGesture(keeb): # Called by the event loop when keeb's chord has been held for holdTime
+    node = keeb.gesture
+    resetGesture(keeb) # Too late to be a tap now, so the release doesn't matter
+    stats.count("holds")
+    runBinding(*node.gestures["hold"], keeb)
+
+def repeatGesture(keeb): # Called by the event loop every repeatRate while keeb's chord bound to :repeat is held
+    node = keeb.gesture
+    keeb.gestureTimer = asyncio.get_running_loop().call_later(settings["repeatRate"] / 1000, repeatGesture, keeb) # Before running it, in case it switches layer and resets us
+    stats.count("repeats")
+    runBinding(*node.gestures["repeat"], keeb, repeating = True)
+
+def runBinding(keycode, value, keeb, eventTime = None, repeating = False): # Executes value, the command bound to keycode in keeb's layer, repeating when it runs again because it is held
+    stats.count("chordMatches")
+
+    if value.startswith("layer:"): # If value is a layerswitch command
+        stats.count("layerSwitches")
+        switchLayer(layerFilename(value.split(':')[-1]), keeb) # Switch to it in memory, no disk writes needed
+        return # A layer switch is not a shell command, so we are done
+
+    binding = (keeb.path, keeb.layer.name, keycode) # The same keys bound on another layer or keyboard are a different binding, and mustn't wait on this one
+    policy = "drop" if repeating else settings["busyPolicy"] # A held key should never build up a backlog of commands
+    if value.split(':')[0] in settingsPossible["busyPolicy"]: # If the binding sets its own policy for when it is still running
+        policy, value = value.split(':', 1) # Use it, and strip it from the command
+
+    if value.startswith("keys:") or value.startswith("text:"): # If value is keys to press or text to type, we do that ourselves, there is nothing to run
+        if virtualKeyboard is None:
+            print(f"Can't emit {value}, there is no virtual keyboard")
+            return
+
+        if value.startswith("keys:"):
+            taps = parseKeys(value.split(':', 1)[1])
+
+            if taps is None:
+                print(f"Can't emit {value}, it contains an unknown keycode")
+                return
+
+        else:
+            taps = textTaps(value.split(':', 1)[1])
+
+        print(keycode + ": " + value)
+        emitTaps(taps) # Writing to the virtual keyboard is far quicker than spawning anything
+        stats.count("keyEmissions")
+        return
+
+    if value.strip().endswith("&") == False and settings["forceBackground"]: # If value is not set in run in the background and our settings say to force running in the background
+        value += " &" # Force running in the background
         
-        else: # If value is a shell command
-            print(keycode+": "+value)
-            os.system(value)
+    if value.strip().endswith("&") == False and settings["backgroundInversion"]: # If value is not set to run in the background and our settings say to invert background mode
+        value += " &" # Force running in the background
+    
+    elif value.strip().endswith("&") and settings["backgroundInversion"]: # Else if value is set to run in the background and our settings say to invert background mode
+        value = value.rstrip(" &") # Remove all spaces and &s from the end of value, there might be a better way but this is the best I've got
 
-def keebLoop(): # Reading the keyboard
-    signal.signal(signal.SIGINT, signal_handler)
-    ledger = keyLedger() # Reset the keyLedger
+    if value.startswith("script:"): # If value is a bash file
+        print("Executing bash script: " + value.split(':')[-1])
+        dispatcher.submit(binding, 'bash ' + scriptDir + value.split(':')[-1], policy, eventTime)
+
+    elif (value.startswith("py:") or value.startswith("py3:")) and warmPython is not None: # If value is a python file and we have a warm interpreter to run it in
+        try:
+            scriptArgs = shlex.split(value.split(':')[-1])
 
-    for event in device.read_loop(): # Start infinitely geting events from our keyboard
-        ledger.update(event) # Update the keyLedger with those events
+        except ValueError as error: # If its quotes don't balance
+            print(f"Can't run {value}, {error}")
+            return
 
-        processKeycode(ledger.getFresh(1)) # Check if ledger.freshKeysList matches a command in our layer's json file
+        while scriptArgs and scriptArgs[-1] == "&": # There is no shell to background it, and no need
+            scriptArgs.pop()
 
-device = InputDevice(config()[0]) # Get a reference to the keyboard on the first line of our config file
+        if scriptArgs == []:
+            print(f"Can't run {value}, it names no script")
+            return
 
-getSettings() # Get settings from the json file in config
+        print("Executing python script in worker: " + value.split(':')[-1])
+        dispatcher.submit(binding, pythonJob(scriptDir + scriptArgs[0], scriptArgs[1:]), policy, eventTime)
 
-if args.layers: # If the user passed --layers
-    getLayers() # Show the user all layer json files and their contents
+    elif value.startswith("py:"): # If value is a generic python file
+        print("Executing python script: " + value.split(':')[-1])
+        dispatcher.submit(binding, 'python ' + scriptDir + value.split(':')[-1], policy, eventTime)
 
-elif args.add: # If the user passed --add
-    device.grab() # Ensure only we receive input from the board
-    writeConfig(1, "default.json") # Ensure we are on the default layer
-    addKey() # Launch the key addition shell
+    elif value.startswith("py2:"): # If value is a python2 file
+        print("Executing python2 script: " + value.split(':')[-1])
+        dispatcher.submit(binding, 'python2 ' + scriptDir + value.split(':')[-1], policy, eventTime)
 
-elif args.device: # If the user passed --device
-    device = InputDevice("/dev/input/by-id/"+args.device) # Get a reference to the specified keyboard
+    elif value.startswith("py3:"): # If value is a python3 file
+        print("Executing python3 script: " + value.split(':')[-1])
+        dispatcher.submit(binding, 'python3 ' + scriptDir + value.split(':')[-1], policy, eventTime)
+    
+    elif value.startswith("exec:"): # If value is a generic executable
+        print("Executing file: " + value.split(':')[-1])
+        dispatcher.submit(binding, scriptDir + value.split(':')[-1], policy, eventTime)
     
-    if os.path.exists(layerDir+args.device+".json") == False: # If the keyboard doesn't yet have a layer json file
-        createLayer(args.device+".json") # Create one
-        print("Created layer file: " + layerDir+args.device+".json") # And notify the user
-
-    writeConfig(1, args.device+".json") # Switch to the specified board's layer json file
-    print("Switched to layer file: " + args.device+".json") # Notify the user
-    device.grab() # Ensure only we receive input from the board
-    keebLoop() # Begin Reading the keyboard for macros
-
-elif args.settings: # If the user passed --settings
-    editSettings() # Launch the setting editing shell
-
-else: # If the user passed nothing
-    device.grab() # Ensure only we receive input from the board
-    writeConfig(1, "default.json") # Ensure we are on the default layer
-    keebLoop() # Begin Reading the keyboard for macros
\ No newline at end of file
+    else: # If value is a shell command
+        print(keycode+": "+value)
+        dispatcher.submit(binding, value, policy, eventTime)
+
+async def readDevice(keeb): # Reads macros from an attached keyboard until it goes away
+    frame = [] # The key events since the last SYN_REPORT
+    dropping = False # Whether the kernel dropped events and we are waiting for the next SYN_REPORT to catch up
+
+    try:
+        async for batch in keeb.device.async_read_batches(): # Get every event the keyboard has for us each time the event loop sees some arrive
+            stats.count("eventsRead", len(batch))
+
+            if keeb.paused: # If the keyboard is back to being a plain keyboard for now
+                continue
+
+            for event in batch:
+                if event.type == ecodes.EV_KEY:
+                    if event.value == 2 and event.code in keeb.ledger.keys: # The kernel's auto-repeat tells us nothing new, we time :repeat bindings ourselves
+                        continue
+
+                    frame.append(event)
+
+                elif event.type == ecodes.EV_SYN:
+                    if event.code == ecodes.SYN_REPORT: # If that's the end of a frame
+                        if dropping: # If the frame is incomplete, trust the kernel over it
+                            keeb.ledger = keyLedger()
+                            keeb.ledger.keys = dict.fromkeys(keeb.device.active_keys())
+                            resetGesture(keeb) # We may have missed the release that would have ended it
+                            dropping = False
+
+                        elif frame != []:
+                            stats.count("framesRead")
+
+                            try:
+                                keeb.ledger.update(frame) # Update the keyboard's keyLedger with the whole frame at once
+
+                                if keeb.ledger.releasedKeys:
+                                    releaseGesture(keeb) # Releasing keys can decide a tap
+
+                                processKeycode(keeb.ledger.getFresh(), keeb, event.timestamp()) # Check if the fresh chord matches a command in the keyboard's layer
+
+                            except Exception: # A bad binding mustn't cost us the keyboard, so log it and carry on with the next frame
+                                print(f"Error handling keys on {keeb.path}:")
+                                traceback.print_exc()
+
+                        frame = []
+
+                    elif event.code == ecodes.SYN_DROPPED: # If the kernel's buffer overflowed
+                        dropping = True
+                        frame = []
+
+    except OSError as error: # If the keyboard was unplugged
+        print(f"Lost device {keeb.path}: {error}")
+
+    finally: # However we stop reading it, let go of it so watchDevices() can attach it again
+        detachDevice(keeb)
+
+def attachDevice(keeb, device = None): # Opens and grabs keeb's device file (or uses device instead, e.g. a replayDevice) and starts reading it, returns whether we succeeded
+    try:
+        keeb.device = device or batchInputDevice(keeb.path) # Get a reference to the keyboard
+
+        if not keeb.paused:
+            keeb.device.grab() # Ensure only we receive input from the board
+
+    except OSError as error: # If it vanished again, we lack permission or another program has grabbed it
+        if keeb.device is not None: # Don't leak the file descriptor on every retry
+            try:
+                keeb.device.close()
+
+            except OSError:
+                pass
+
+        keeb.device = None
+        keeb.retryDelay = min(keeb.retryDelay * 2 or 1, 60) # Back off, so a device that stays busy doesn't fill the log
+        keeb.retryTime = time.monotonic() + keeb.retryDelay
+        print(f"Could not attach {keeb.path}: {error}, retrying in {keeb.retryDelay}s")
+        return False
+
+    keeb.retryDelay = 0
+    print(f"Attached {keeb.path}")
+    keeb.ledger = keyLedger() # Any keys we knew to be held are stale now
+    switchLayer(keeb.defaultLayer, keeb) # Start from the keyboard's own layer
+    keeb.task = asyncio.ensure_future(readDevice(keeb)) # Read it alongside every other keyboard
+    return True
+
+def detachDevice(keeb): # Forgets keeb's device after it has gone away, so watchDevices() can reattach it
+    try:
+        keeb.device.close()
+
+    except OSError:
+        pass # It's gone anyway
+
+    keeb.device = None
+    keeb.task = None
+    resetSequence(keeb) # Nothing will be released or pressed to finish them now
+    resetGesture(keeb)
+    print(f"Detached {keeb.path}")
+
+controlHelp = """Commands:
+  status - List our keyboards and the layer each is on
+  layers - List the available layer files
+  layer <layer> [device] - Switch a keyboard (the first by default) to a layer
+  add <layer> <keys> <command> - Bind keys to a command in a layer
+  reload - Reload settings and layer files from disk
+  pause [device] - Let go of a keyboard (every one by default) so it types normally
+  resume [device] - Take a paused keyboard back
+  save - Save the first keyboard's layer to config
+  stats - Show our stats"""
+
+def findKeebs(name = None): # Returns a list of the keebDevices whose path or file name is name, or all of them if name is None
+    if name is None:
+        return keebs
+
+    return [keeb for keeb in keebs if keeb.path == name or os.path.basename(keeb.path) == name]
+
+def controlCommand(words): # Carries out a control socket command (a list of words) and returns the response to send back
+    if words == [] or words[0] == "help":
+        return controlHelp
+
+    command, arguments = words[0], words[1:]
+
+    if command == "status":
+        lines = []
+        for keeb in keebs:
+            state = "paused" if keeb.paused else "attached" if keeb.device is not None else "waiting"
+            lines.append(f"{keeb.path}: {state}, layer {keeb.layer.name if keeb.layer else keeb.defaultLayer}")
+        return "\n".join(lines)
+
+    elif command == "layers":
+        return "\n".join(sorted(f for f in os.listdir(layerDir) if f.endswith(".json")))
+
+    elif command == "layer" and len(arguments) in (1, 2):
+        layer = layerFilename(arguments[0])
+        targets = findKeebs(arguments[1]) if len(arguments) == 2 else keebs[:1]
+
+        for keeb in targets:
+            switchLayer(layer, keeb)
+        return f"Switched {len(targets)} keyboard(s) to {layer}"
+
+    elif command == "add" and len(arguments) >= 3:
+        layer = layerFilename(arguments[0])
+
+        try:
+            writeLayers({layer: {arguments[1]: " ".join(arguments[2:])}}) # Which won't write anything we won't be able to read back
+
+        except ValueError as error:
+            return f"Can't bind \"{arguments[1]}\", {error}"
+        return f"Bound {arguments[1]} to \"{' '.join(arguments[2:])}\" in {layer}"
+
+    elif command == "reload":
+        getSettings()
+        loadedLayers.loadAll() # Settings like multiKeyMode change how layers compile, so recompile them all
+        return "Reloaded settings and layers"
+
+    elif command in ("pause", "resume") and len(arguments) <= 1:
+        targets = findKeebs(arguments[0] if arguments else None)
+
+        for keeb in targets:
+            keeb.paused = command == "pause"
+            resetSequence(keeb)
+            resetGesture(keeb)
+
+            if keeb.device is not None:
+                try:
+                    if keeb.paused:
+                        keeb.device.ungrab()
+
+                    else:
+                        keeb.ledger = keyLedger() # Whatever was pressed while paused isn't ours
+                        keeb.device.grab()
+
+                except OSError as error:
+                    return f"Couldn't {command} {keeb.path}: {error}"
+
+        return f"{command.capitalize()}d {len(targets)} keyboard(s)"
+
+    elif command == "save":
+        return f"Saved {saveLayer()} to config"
+
+    elif command == "stats":
+        return stats.report()
+
+    return f"Unrecognized command: {' '.join(words)}\n{controlHelp}"
+
+async def handleControl(reader, writer): # Answers one command from a control socket client
+    try:
+        line = await reader.readline()
+
+        if line == b"": # If it hung up without asking anything, like another keebLoop checking we're alive
+            writer.close()
+            return
+
+        response = controlCommand(shlex.split(line.decode()))
+
+    except (ValueError, OSError) as error: # A bad command shouldn't take the loop down with it
+        response = f"Error: {error}"
+
+    try:
+        writer.write((response + "\n").encode())
+        await writer.drain()
+
+    except ConnectionError: # If it stopped waiting for our answer
+        pass
+
+    writer.close()
+
+async def serveControl(): # Listens for commands on our control socket, unless another keebLoop already is
+    global servingControl
+
+    if os.path.exists(socketPath):
+        try:
+            reader, writer = await asyncio.open_unix_connection(socketPath)
+            writer.close()
+            answered = True
+
+        except OSError: # Nobody is listening, it is left over from a keebLoop that didn't exit cleanly
+            answered = False
+
+        if answered:
+            raise OSError("another Keebie is already listening there")
+
+        os.unlink(socketPath)
+
+    server = await asyncio.start_unix_server(handleControl, path=socketPath)
+    os.chmod(socketPath, 0o600) # Only our user gets to drive us
+    servingControl = True
+    return server
+
+def removeControl(): # Removes our control socket, if we made it, so it isn't left behind when we exit
+    if servingControl and os.path.exists(socketPath):
+        os.unlink(socketPath)
+
+def watchSignals(): # Lets the user ask for our stats with `kill -USR1` and ask us to persist the active layer with `kill -USR2`
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGUSR1, dumpStats) # Run by the event loop between callbacks, never in the middle of one holding stats.lock or printing
+    loop.add_signal_handler(signal.SIGUSR2, saveLayer)
+
+async def watchDevices(pollInterval = 1): # Attaches each of our keyboards whenever its device file appears, forever
+    watchSignals()
+
+    try:
+        await serveControl() # Take commands while we run
+
+    except OSError as error:
+        print(f"Could not listen on {socketPath}, --ctl won't work: {error}")
+
+    for keeb in keebs:
+        if os.path.exists(keeb.path) == False:
+            print(f"Waiting for {keeb.path}")
+
+    while True:
+        for keeb in keebs:
+            if keeb.device is None and not os.path.exists(keeb.path): # A keyboard that is unplugged gets a fresh start when it's plugged back in
+                keeb.retryDelay = 0
+                keeb.retryTime = 0
+
+            elif keeb.device is None and time.monotonic() >= keeb.retryTime: # If a keyboard has been plugged (back) in, and we aren't backing off from failing to attach it
+                attachDevice(keeb)
+
+        loadedLayers.refresh() # Pick up edited layer files, one layer at a time
+
+        await asyncio.sleep(pollInterval) # Checking a few paths a second is far cheaper than a process per keyboard, or a stat on every key press
+
+async def replayDevices(device): # Reads macros from device on our first keyboard until it runs out of events
+    watchSignals()
+
+    if attachDevice(keebs[0], device):
+        await keebs[0].task
+
+def benchmark(path, rounds): # Replays the recording at path through processKeycode as fast as possible and reports latency and throughput
+    global dispatcher
+    dispatcher = benchmarkDispatcher() # Record commands rather than running them
+
+    device = replayDevice(path, realtime = False)
+    keebs.append(keebDevice(path, "default.json"))
+    loadedLayers.loadAll()
+
+    startTime = time.perf_counter()
+    for roundIndex in range(0, rounds):
+        runReplay(device)
+    elapsed = time.perf_counter() - startTime
+
+    events = len(device.events) * rounds
+    latencies = sorted(dispatcher.latencies)
+
+    print(f"Replayed {events} events in {elapsed:.3f}s, {events / elapsed:.0f} events/s")
+
+    if latencies == []:
+        print("No commands were dispatched, check the recording presses keys bound in default.json")
+        return
+
+    print(f"Dispatched {len(latencies)} commands, event to dispatch latency:")
+    for label, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99)):
+        print(f"  {label}: {percentile(latencies, fraction) * 1000000:.0f}us")
+    print(f"  max: {latencies[-1] * 1000000:.0f}us")
+
+def keebLoop(replay = None): # Reading all of our keyboards in one event loop, or just the replayDevice replay
+    global dispatcher, warmPython
+    dispatcher = actionDispatcher(settings["maxWorkers"]) # Start the workers that will run our commands
+
+    loadedLayers.loadAll() # Compile every layer, and warn about broken ones, before the first key press
+    openVirtualKeyboard() # Open the virtual keyboard keys: and text: bindings use, once for the life of the loop
+
+    if settings["pythonWorker"]:
+        warmPython = pythonWorker() # Run python scripts in a warm interpreter, it starts with the first one
+
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler) # Exit the same way when stopped, so our control socket is cleaned up
+
+    if replay is not None:
+        runReplay(replay)
+        dispatcher.queue.join() # Let the commands the recording triggered finish before we exit
+
+    else:
+        try:
+            asyncio.run(watchDevices())
+
+        finally:
+            removeControl()
+
+def benchmarkStartup(targetMs, rounds = 10): # Times fresh launches of --layers, which must not touch input devices, and exits with 1 if the median is over targetMs
+    def launch(command): # Returns how many seconds command takes to run
+        startTime = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL)
+        return time.perf_counter() - startTime
+
+    bare = sorted(launch([sys.executable, "-c", "pass"]) for roundIndex in range(0, rounds)) # What no script at all costs, for comparison
+    keebie = sorted(launch([sys.executable, os.path.abspath(__file__), "--layers"]) for roundIndex in range(0, rounds))
+    median = keebie[rounds // 2] * 1000
+
+    print(f"python3 alone: {bare[rounds // 2] * 1000:.0f}ms, keebie.py --layers: {median:.0f}ms (min {keebie[0] * 1000:.0f}ms, max {keebie[-1] * 1000:.0f}ms), target {targetMs}ms")
+
+    if median > targetMs:
+        print("Startup is over target")
+        sys.exit(1)
+
+def main(): # Does whatever our command line arguments ask
+    parser = argparse.ArgumentParser() # Set up command line arguments
+    parser.add_argument("--layers", help="Show saved layer files", action="store_true")
+    parser.add_argument("--device", help="Change target device, can be given more than once to serve several devices", action="append")
+    parser.add_argument("--add", help="Add new keys", action="store_true")
+    parser.add_argument("--settings", help="Edits settings file", action="store_true")
+    parser.add_argument("--record", help="Record events from the device to a file", metavar="FILE")
+    parser.add_argument("--replay", help="Run macros from events recorded in a file instead of a device", metavar="FILE")
+    parser.add_argument("--fast", help="Replay events as fast as possible instead of with their recorded timing", action="store_true")
+    parser.add_argument("--benchmark", help="Report latency and throughput for replaying events recorded in a file", metavar="FILE")
+    parser.add_argument("--rounds", help="How many times --benchmark replays the file", type=int, default=10)
+    parser.add_argument("--import", help="Add the bindings in a json or csv file (- for stdin) to their layers, all or nothing", metavar="FILE", dest="importFile")
+    parser.add_argument("--export", help="Write every binding in every layer to a json or csv file (stdout by default)", nargs="?", const="-", metavar="FILE")
+    parser.add_argument("--format", help="The format for --import and --export, guessed from the file name by default", choices=["json", "csv"])
+    parser.add_argument("--bench-startup", help="Time launching the commands that don't read input, failing if it takes more than MS milliseconds (150 by default)", nargs="?", const=150, type=int, metavar="MS")
+    parser.add_argument("--ctl", help="Send a command to the running Keebie, run --ctl help to list them", nargs="+", metavar="COMMAND")
+    parser.add_argument("--python-worker", help=argparse.SUPPRESS, type=int, metavar="FD") # Used by pythonWorker to launch servePython()
+    args = parser.parse_args()
+
+    if args.python_worker is not None: # If we are a pythonWorker's interpreter
+        servePython(args.python_worker) # Serve it, and nothing else
+        return
+
+    if args.ctl: # If the user passed --ctl
+        sendControl(args.ctl) # Pass their command on to the running Keebie
+        return
+
+    if args.export: # If the user passed --export
+        exportBindings(args.export, args.format) # Before we print anything, since the export may be going to stdout
+        return
+
+    if args.bench_startup is not None: # If the user passed --bench-startup
+        benchmarkStartup(args.bench_startup)
+        return
+
+    print("Welcome to Keebie")
+
+    getSettings() # Get settings from the json file in config
+
+    if not (args.layers or args.settings): # Only pay for evdev and asyncio (and only need a device) when we read input
+        importInput()
+
+    if args.layers: # If the user passed --layers
+        getLayers() # Show the user all layer json files and their contents
+
+    elif args.add: # If the user passed --add
+        device = evdev.InputDevice(config()[0]) # Get a reference to the keyboard on the first line of our config file
+        device.grab() # Ensure only we receive input from the board
+        addKey(device) # Launch the key addition shell, adding to the default layer
+
+    elif args.importFile: # If the user passed --import
+        importBindings(args.importFile, args.format)
+
+    elif args.record: # If the user passed --record
+        device = evdev.InputDevice("/dev/input/by-id/"+args.device[0] if args.device else config()[0]) # Get a reference to the keyboard they named, or the one in config
+        recordDevice(device, args.record) # Record it
+
+    elif args.replay: # If the user passed --replay
+        keebs.append(keebDevice(args.replay, "default.json")) # Serve the recording on the default layer
+        keebLoop(replayDevice(args.replay, realtime = not args.fast)) # Run macros from it
+
+    elif args.benchmark: # If the user passed --benchmark
+        benchmark(args.benchmark, args.rounds)
+
+    elif args.device: # If the user passed --device
+        for deviceName in args.device: # For every keyboard they named
+            keebs.append(keebDevice("/dev/input/by-id/"+deviceName, deviceName+".json")) # Serve it, on its own layer json file
+
+        keebLoop() # Begin Reading the keyboards for macros
+
+    elif args.settings: # If the user passed --settings
+        editSettings() # Launch the setting editing shell
+
+    else: # If the user passed nothing
+        keebs.append(keebDevice(config()[0], "default.json")) # Serve the keyboard on the first line of our config file, on the default layer
+        keebLoop() # Begin Reading the keyboard for macros
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""Helpers for driving keebie.py --replay with generated recordings, so no keyboard is needed."""
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+ecodes = pytest.importorskip("evdev").ecodes
+
+repoDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def tap(seconds, keycode):
+    """Returns the presses for tapping keycode at seconds."""
+    return [(seconds, keycode, 1), (seconds + 0.02, keycode, 0)]
+
+def replay(tmp_path, layer, presses, fast = True):
+    """Replays presses, a list of (seconds, keycode, value) tuples, on a copy of keebie whose default layer is layer, and returns the labels of the bindings that ran in order.
+
+    Every command in layer should be "true <label>", which keebie prints as it runs it. Replays run on keebie's virtual clock unless fast is False.
+    """
+    for name in ("keebie.py", "config", "settings.json"):
+        shutil.copy(os.path.join(repoDir, name), tmp_path / name)
+
+    os.makedirs(tmp_path / "layers", exist_ok=True)
+    os.makedirs(tmp_path / "scripts", exist_ok=True)
+    (tmp_path / "layers" / "default.json").write_text(json.dumps(layer))
+
+    with open(tmp_path / "presses.rec", "w") as f:
+        for seconds, keycode, value in presses:
+            f.write(f"{seconds:.3f} {ecodes.EV_KEY} {ecodes.ecodes[keycode]} {value}\n")
+            f.write(f"{seconds:.3f} {ecodes.EV_SYN} {ecodes.SYN_REPORT} 0\n")
+
+    command = [sys.executable, str(tmp_path / "keebie.py"), "--replay", str(tmp_path / "presses.rec")] + (["--fast"] if fast else [])
+    result = subprocess.run(command, capture_output=True, text=True, timeout=30)
+    assert result.returncode == 0, result.stdout + result.stderr
+
+    return re.findall(r"^\S+: true (\S+)$", result.stdout, re.MULTILINE)
@@ -0,0 +1,28 @@
+"""Replay-driven checks of :tap, :hold, :double and :repeat bindings, run through keebie.py --replay."""
+from replaying import replay, tap
+
+def test_double_tap(tmp_path):
+    layer = {"KEY_C": "true tap", "KEY_C:double": "true double"}
+    presses = tap(0.0, "KEY_C") + tap(0.1, "KEY_C") + tap(0.8, "KEY_C") + tap(1.6, "KEY_Z") # A double tap, then a tap on its own
+    assert replay(tmp_path, layer, presses) == ["double", "tap"]
+
+def test_slow_tap_without_hold(tmp_path):
+    layer = {"KEY_C": "true tap", "KEY_C:double": "true double"}
+    presses = [(0.0, "KEY_C", 1), (0.4, "KEY_C", 0)] + tap(1.0, "KEY_Z") # Held past holdTime, but there's no :hold to make it anything but a tap
+    assert replay(tmp_path, layer, presses) == ["tap"]
+
+def test_chord_double_tap_with_modifier_pressed_again(tmp_path):
+    layer = {"KEY_LEFTCTRL+KEY_A": "true tap", "KEY_LEFTCTRL+KEY_A:double": "true double"}
+    presses = [(0.0, "KEY_LEFTCTRL", 1), (0.02, "KEY_A", 1), (0.05, "KEY_A", 0), (0.06, "KEY_LEFTCTRL", 0)]
+    presses += [(0.1, "KEY_LEFTCTRL", 1), (0.12, "KEY_A", 1), (0.15, "KEY_A", 0), (0.16, "KEY_LEFTCTRL", 0)]
+    assert replay(tmp_path, layer, presses + tap(0.8, "KEY_Z")) == ["double"]
+
+def test_tap_and_hold(tmp_path):
+    layer = {"KEY_B": "true tap", "KEY_B:hold": "true hold"}
+    presses = tap(0.0, "KEY_B") + [(0.5, "KEY_B", 1), (1.2, "KEY_B", 0)] + tap(1.5, "KEY_Z")
+    assert replay(tmp_path, layer, presses) == ["tap", "hold"]
+
+def test_repeat_stops_on_release(tmp_path):
+    layer = {"KEY_D:repeat": "true repeat"}
+    held = [(0.0, "KEY_D", 1)] + [(0.25 + 0.03 * index, "KEY_D", 2) for index in range(0, 7)] + [(0.45, "KEY_D", 0)] # The kernel's own auto-repeat shouldn't add any
+    assert replay(tmp_path, layer, held + tap(1.5, "KEY_Z")) == ["repeat"] * 3 # On press, then every repeatRate from holdTime, and none after the release
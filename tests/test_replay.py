@@ -0,0 +1,20 @@
+"""Replay-driven checks of sequence matching, run through keebie.py --replay."""
+import pytest
+
+from replaying import replay, tap
+
+def test_longest_sequence_wins(tmp_path):
+    layer = {"KEY_A,KEY_B": "true ab", "KEY_A,KEY_B,KEY_C": "true abc"}
+    presses = tap(0.0, "KEY_A") + tap(0.1, "KEY_B") + tap(0.2, "KEY_C")
+    assert replay(tmp_path, layer, presses) == ["abc"]
+
+def test_shorter_sequence_runs_when_broken(tmp_path):
+    layer = {"KEY_A,KEY_B": "true ab", "KEY_A,KEY_B,KEY_C": "true abc", "KEY_D": "true d"}
+    presses = tap(0.0, "KEY_A") + tap(0.1, "KEY_B") + tap(0.2, "KEY_D")
+    assert replay(tmp_path, layer, presses) == ["ab", "d"]
+
+@pytest.mark.parametrize("fast", [True, False]) # The virtual clock should time sequences out just like the real one
+def test_shorter_sequence_runs_on_timeout(tmp_path, fast):
+    layer = {"KEY_A": "true a", "KEY_A,KEY_B@200": "true ab", "KEY_D": "true d"}
+    presses = tap(0.0, "KEY_A") + tap(0.6, "KEY_B") + tap(0.8, "KEY_D") # KEY_B comes too late to continue the sequence
+    assert replay(tmp_path, layer, presses, fast) == ["a", "d"]